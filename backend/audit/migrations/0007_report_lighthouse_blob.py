@@ -0,0 +1,43 @@
+# Generated by Django 5.2.12 on 2026-10-15 10:12
+
+import orjson
+import zstandard
+from django.db import migrations, models
+
+
+def compress_lighthouse_json(apps, schema_editor):
+    Report = apps.get_model('audit', 'Report')
+    compressor = zstandard.ZstdCompressor(level=6)
+    reports = Report.objects.filter(lighthouse_json__isnull=False).only('id', 'lighthouse_json')
+    for report in reports.iterator(chunk_size=100):
+        report.lighthouse_blob = compressor.compress(orjson.dumps(report.lighthouse_json))
+        report.save(update_fields=['lighthouse_blob'])
+
+
+def decompress_lighthouse_blob(apps, schema_editor):
+    Report = apps.get_model('audit', 'Report')
+    decompressor = zstandard.ZstdDecompressor()
+    reports = Report.objects.filter(lighthouse_blob__isnull=False).only('id', 'lighthouse_blob')
+    for report in reports.iterator(chunk_size=100):
+        report.lighthouse_json = orjson.loads(decompressor.decompress(report.lighthouse_blob))
+        report.save(update_fields=['lighthouse_json'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0006_remove_report_display_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='lighthouse_blob',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(compress_lighthouse_json, decompress_lighthouse_blob),
+        migrations.RemoveField(
+            model_name='report',
+            name='lighthouse_json',
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.12 on 2026-10-15 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0007_report_lighthouse_blob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['-created_at'], name='report_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['user_identifier', '-created_at'], name='report_user_created_idx'),
+        ),
+    ]
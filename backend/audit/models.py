@@ -1,10 +1,29 @@
 import uuid
 import secrets
+import orjson
+import zstandard
 from django.db import models
 
+
+def compress_json(data):
+    """Serializes `data` to JSON and zstd-compresses it."""
+    return zstandard.ZstdCompressor(level=6).compress(orjson.dumps(data))
+
+
+def decompress_json(blob):
+    """Inverse of compress_json."""
+    return orjson.loads(zstandard.ZstdDecompressor().decompress(blob))
+
+
 class Report(models.Model):
     class Meta:
         app_label = 'audit'
+        indexes = [
+            # Default list ordering and the age-based cleanup
+            models.Index(fields=['-created_at'], name='report_created_idx'),
+            # Per-user history, newest first
+            models.Index(fields=['user_identifier', '-created_at'], name='report_user_created_idx'),
+        ]
 
     STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -30,7 +49,8 @@ class Report(models.Model):
     device_type = models.CharField(max_length=10, choices=DEVICE_CHOICES, default='desktop')
     network_type = models.CharField(max_length=10, choices=NETWORK_CHOICES, default='4g')
     performance_score = models.IntegerField(null=True, blank=True)
-    lighthouse_json = models.JSONField(null=True, blank=True)
+    # zstd-compressed JSON, read and written through `lighthouse_json`
+    lighthouse_blob = models.BinaryField(null=True, blank=True, editable=False)
     ai_summary = models.TextField(null=True, blank=True)
     screenshot = models.ImageField(upload_to='screenshots/', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -38,6 +58,16 @@ class Report(models.Model):
     def __str__(self):
         return f"{self.url} - {self.status}"
 
+    @property
+    def lighthouse_json(self):
+        if self.lighthouse_blob is None:
+            return None
+        return decompress_json(self.lighthouse_blob)
+
+    @lighthouse_json.setter
+    def lighthouse_json(self, data):
+        self.lighthouse_blob = None if data is None else compress_json(data)
+
 def generate_share_token():
     return secrets.token_urlsafe(32)
 
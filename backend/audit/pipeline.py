@@ -0,0 +1,811 @@
+"""
+Building blocks of an audit: the shared browser, Lighthouse, screenshots,
+result caching and the Gemini summary. The Celery tasks in tasks.py
+orchestrate these.
+"""
+from django.conf import settings
+import subprocess
+import orjson
+import os
+import re
+import base64
+import hashlib
+import heapq
+import ijson
+import requests
+import google.genai as genai
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from django.core.files import File
+from django.core.cache import cache
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import closing
+from celery.signals import worker_process_init, worker_process_shutdown, worker_ready
+
+def get_free_port():
+    """Finds an available ephemeral port for concurrent Playwright/Lighthouse runs."""
+    with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
+        s.bind(('', 0))
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        return s.getsockname()[1]
+
+# ─── Device and Network Configuration ───────────────────────────────────────
+
+DEVICE_CONFIGS = {
+    'mobile': {
+        'viewport': {'width': 390, 'height': 844},
+        'is_mobile': True,
+        'has_touch': True,
+        'device_scale_factor': 3,
+    },
+    'desktop': {
+        'viewport': {'width': 1366, 'height': 768},
+        'is_mobile': False,
+        'has_touch': False,
+        'device_scale_factor': 1,
+    },
+}
+
+# Throughput values are in bytes/sec (Lighthouse/CDP convention)
+NETWORK_PRESETS = {
+    'slow3g': {
+        'offline': False,
+        'latency': 400,
+        'downloadThroughput': 51200,       
+        'uploadThroughput': 51200,        
+    },
+    'fast3g': {
+        'offline': False,
+        'latency': 150,
+        'downloadThroughput': 209715,      
+        'uploadThroughput': 78643,         
+    },
+    '4g': {
+        'offline': False,
+        'latency': 40,
+        'downloadThroughput': 1179648,     
+        'uploadThroughput': 1179648,       
+    },
+}
+
+# ─── Persistent Browser ─────────────────────────────────────────────────────
+
+# Each worker process keeps a single Playwright driver alive across audits.
+# Chromium itself is relaunched (cheap with the driver already up) before each
+# Lighthouse pass, so no DNS cache or keep-alive sockets from an earlier audit
+# let a throttled run skip connection setup. Lighthouse attaches to it over
+# the remote debugging port and screenshots use a throwaway BrowserContext.
+_browser_lock = threading.Lock()
+_playwright = None
+_browser = None
+_debug_port = None
+_executable_path = None
+_browser_threadpool = None
+# Set once an audit has used the current Chromium (the warm-up page doesn't count)
+_browser_used = False
+
+# Lighthouse numbers are skewed by other navigations sharing the same Chrome,
+# so browser work is serialized per worker (start.sh also runs one heavy
+# process per host, as parallel runs skew it through CPU contention). Under
+# the gevent pool the other audits keep running their I/O meanwhile.
+_audit_browser_lock = threading.Lock()
+
+
+def _gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def _browser_call(fn, *args, **kwargs):
+    """Runs fn on the thread that owns the Playwright driver.
+
+    Playwright's sync API is bound to the thread that started it and does not
+    cooperate with gevent's monkey-patching, so under the gevent pool all
+    browser work goes through one native thread while the calling greenlet yields.
+    """
+    global _browser_threadpool
+    if not _gevent_patched():
+        return fn(*args, **kwargs)
+    if _browser_threadpool is None:
+        from gevent.threadpool import ThreadPool
+        _browser_threadpool = ThreadPool(1)
+    return _browser_threadpool.apply(fn, args, kwargs)
+
+
+def _get_browser(fresh=False):
+    """Returns (browser, debug_port, executable_path), launching Chromium on first use.
+
+    With `fresh`, a Chromium that an earlier audit already used is replaced by
+    a new one so the caller starts from clean network state.
+    """
+    global _playwright, _browser, _debug_port, _executable_path, _browser_used
+    with _browser_lock:
+        if _browser is not None and _browser.is_connected():
+            if not (fresh and _browser_used):
+                _browser_used = _browser_used or fresh
+                return _browser, _debug_port, _executable_path
+            try: _browser.close()
+            except: pass
+
+        if _playwright is None:
+            _playwright = sync_playwright().start()
+            _executable_path = _playwright.chromium.executable_path
+
+        # Get dynamic port so concurrent workers don't collide
+        _debug_port = get_free_port()
+        _browser = _playwright.chromium.launch(
+            headless=True,
+            args=[f'--remote-debugging-port={_debug_port}']
+        )
+        _browser_used = fresh
+        print(f"Launched Chromium on port {_debug_port} (Binary: {_executable_path})")
+        return _browser, _debug_port, _executable_path
+
+
+def _close_browser():
+    """Closes the shared browser and stops the Playwright driver."""
+    global _playwright, _browser, _debug_port
+    with _browser_lock:
+        if _browser:
+            try: _browser.close()
+            except: pass
+        if _playwright:
+            try: _playwright.stop()
+            except: pass
+        _playwright = None
+        _browser = None
+        _debug_port = None
+
+
+def _open_blank_page():
+    browser, _, _ = _get_browser()
+    page = browser.new_page()
+    try:
+        page.goto('about:blank')
+    finally:
+        page.close()
+
+
+def warm_up_worker():
+    """Launches Chromium, renders a blank page and loads the Lighthouse CLI once,
+    so the first real audit doesn't pay for cold starts."""
+    try:
+        _browser_call(_open_blank_page)
+    except Exception as e:
+        # Not fatal: the first audit will retry the launch lazily
+        print(f"Failed to pre-launch browser for worker: {e}")
+    try:
+        subprocess.run(['lighthouse', '--version'], capture_output=True, timeout=30)
+    except Exception as e:
+        print(f"Failed to warm up Lighthouse CLI: {e}")
+
+
+@worker_process_init.connect
+def init_worker_browser(**kwargs):
+    # Runs before the child reports ready, hence CELERY_WORKER_PROC_ALIVE_TIMEOUT.
+    # It can't move to a background thread: Playwright's sync API is bound to
+    # the thread that starts it, and it keeps an event loop alive on this thread
+    os.environ["DJANGO_ALLOW_ASYNC_UNSAFE"] = "true"
+    warm_up_worker()
+
+
+@worker_ready.connect
+def ready_worker_browser(sender=None, **kwargs):
+    # Prefork children are warmed in worker_process_init; solo/gevent pools run
+    # tasks in this process, so warm it here, but only if it runs browser audits
+    from celery.concurrency.prefork import TaskPool as PreforkPool
+    if isinstance(getattr(sender.controller, 'pool', None), PreforkPool):
+        return
+    queues = {queue.name for queue in sender.task_consumer.queues}
+    if 'heavy' not in queues:
+        return
+    os.environ["DJANGO_ALLOW_ASYNC_UNSAFE"] = "true"
+    warm_up_worker()
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_browser(**kwargs):
+    _close_browser()
+
+
+# ─── Report Projection ──────────────────────────────────────────────────────
+
+# Only `categories`, `audits` and the trace screenshots are read by the
+# frontend, the filmstrip endpoint and the AI prompt.
+CATEGORY_FIELDS = ('id', 'title', 'score')
+AUDIT_FIELDS = (
+    'id', 'title', 'description', 'score', 'scoreDisplayMode',
+    'displayValue', 'numericValue', 'numericUnit',
+)
+# Audits whose `details` are used (network waterfall, screenshot fallback)
+DETAILED_AUDITS = {
+    'network-requests',
+    'render-blocking-resources',
+    'modern-image-formats',
+    'uses-optimized-images',
+    'uses-webp-images',
+    'final-screenshot',
+}
+# Screenshot frames plus the events used to anchor their timing
+TRACE_EVENT_NAMES = {
+    'Screenshot',
+    'navigationStart',
+    'TracingStartedInBrowser',
+    'firstContentfulPaint',
+}
+
+
+def load_lighthouse_report(path):
+    """Stream-parses a Lighthouse JSON report into the compact projection we store.
+
+    With AUDIT_STORE_FULL_REPORT enabled the whole report is kept instead.
+    """
+    if settings.AUDIT_STORE_FULL_REPORT:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+
+    with open(path, 'rb') as f:
+        categories = {
+            key: {field: category[field] for field in CATEGORY_FIELDS if field in category}
+            for key, category in ijson.kvitems(f, 'categories', use_float=True)
+        }
+        f.seek(0)
+        audits = {}
+        for key, audit in ijson.kvitems(f, 'audits', use_float=True):
+            projected = {field: audit[field] for field in AUDIT_FIELDS if field in audit}
+            if key in DETAILED_AUDITS and 'details' in audit:
+                projected['details'] = audit['details']
+            audits[key] = projected
+    return {'categories': categories, 'audits': audits}
+
+
+# ─── Result Cache ───────────────────────────────────────────────────────────
+
+# Bump whenever the Lighthouse flags or post-processing change so that
+# results produced by an older configuration (or entry format) are not
+# served from cache.
+LH_CONFIG_VERSION = 4
+
+
+# Pooled keep-alive connections for the HEAD probes, shared by all audits
+_http_session = requests.Session()
+_http_adapter = requests.adapters.HTTPAdapter(pool_connections=20, pool_maxsize=20)
+_http_session.mount('http://', _http_adapter)
+_http_session.mount('https://', _http_adapter)
+
+
+def get_page_validators(url):
+    """Returns the page's ETag/Last-Modified validators, or '' if unavailable."""
+    try:
+        response = _http_session.head(url, allow_redirects=True, timeout=5)
+    except requests.RequestException:
+        return ''
+    return response.headers.get('ETag', '') + response.headers.get('Last-Modified', '')
+
+
+def lighthouse_cache_key(url, device_type, network_type, validators=''):
+    """Cache key for a Lighthouse result of `url` under a given device/network config."""
+    key = f"lh:{hashlib.sha1(url.encode()).hexdigest()}:{device_type}:{network_type}:{LH_CONFIG_VERSION}"
+    # Full and projected reports must not be served in place of each other
+    if settings.AUDIT_STORE_FULL_REPORT:
+        key += ":full"
+    if validators:
+        key += f":{hashlib.sha1(validators.encode()).hexdigest()}"
+    return key
+
+
+# The lock is held for the whole audit: Lighthouse (up to 330s), the
+# screenshot (up to 35s), storage uploads and the report saves
+AUDIT_LOCK_TIMEOUT = 600
+# How long a duplicate audit waits for the in-flight one before running its own
+AUDIT_LOCK_WAIT = 150
+# First delay before a waiting duplicate checks for the in-flight result;
+# later checks back off exponentially
+AUDIT_LOCK_POLL = 5
+
+
+def _audit_lock(cache_key, **kwargs):
+    return cache.lock(f"audit-lock:{cache_key}", **kwargs)
+
+
+def acquire_audit_lock(cache_key):
+    """Tries to take the per-page audit lock so concurrent audits of one page coalesce.
+
+    Never blocks. Returns (lock, busy): the held lock (None if the cache backend
+    can't lock, the caller then simply runs its own audit) and whether another
+    audit of the page currently holds it.
+    """
+    if not hasattr(cache, 'lock'):
+        return None, False
+    lock = _audit_lock(cache_key, timeout=AUDIT_LOCK_TIMEOUT)
+    try:
+        if lock.acquire(blocking=False):
+            return lock, False
+        return None, True
+    except Exception as e:
+        print(f"Audit lock unavailable for {cache_key}: {e}")
+    return None, False
+
+
+def audit_lock_held(cache_key):
+    """Whether an audit of the page behind `cache_key` currently holds the lock."""
+    if not hasattr(cache, 'lock'):
+        return False
+    try:
+        return _audit_lock(cache_key).locked()
+    except Exception as e:
+        print(f"Audit lock unavailable for {cache_key}: {e}")
+        return False
+
+
+def next_lock_poll(waited):
+    """Delay before the next check for an in-flight result, doubling as the wait grows."""
+    return min(max(AUDIT_LOCK_POLL, waited), AUDIT_LOCK_WAIT - waited)
+
+
+def release_audit_lock(lock):
+    if lock is None:
+        return
+    try: lock.release()
+    except: pass
+
+
+def run_lighthouse(url, report_id, network_preset, port=9222, chrome_path=None, device_type='desktop'):
+    """Runs Lighthouse audit attached to an existing Chrome instance."""
+    lighthouse_report_path = f"/tmp/report_{report_id}.json"
+    
+    # Lighthouse CLI flag expects Kilobits per second (Kbps)
+    dl_kbps = (network_preset['downloadThroughput'] * 8) // 1024
+    ul_kbps = (network_preset['uploadThroughput'] * 8) // 1024
+    
+    # Base command
+    cmd = [
+        "lighthouse",
+        url,
+        f"--port={port}",
+        "--output=json",
+        f"--output-path={lighthouse_report_path}",
+        "--only-categories=performance,accessibility,best-practices,seo",
+        "--save-assets",
+        "--disable-full-page-screenshot",
+        # The filmstrip is built from trace Screenshot events, so the
+        # thumbnails audit is never read; final-screenshot is kept for fallbacks
+        "--skip-audits=screenshot-thumbnails",
+        "--max-wait-for-load=300000",
+        
+        # Enable DevTools throttling and pass custom dynamic parameters
+        "--throttling-method=devtools",
+        f"--throttling.requestLatencyMs={network_preset['latency']}",
+        f"--throttling.downloadThroughputKbps={dl_kbps}",
+        f"--throttling.uploadThroughputKbps={ul_kbps}",
+    ]
+    
+    # Device-specific flags
+    if device_type == 'mobile':
+        cmd.extend([
+            "--form-factor=mobile",
+            "--throttling.cpuSlowdownMultiplier=4"
+        ])
+    else:
+        cmd.extend([
+            "--form-factor=desktop",
+            "--screenEmulation.mobile=false",
+            "--screenEmulation.width=1350",
+            "--screenEmulation.height=940",
+            "--screenEmulation.deviceScaleFactor=1",
+            "--throttling.cpuSlowdownMultiplier=1"
+        ])
+    
+    # Set environment variables
+    env = os.environ.copy()
+    if chrome_path:
+        env["CHROME_PATH"] = chrome_path
+        print(f"Lighthouse using CHROME_PATH: {chrome_path}")
+    
+    timed_out = False
+    try:
+        # Added timeout=330s protection (increased for trace generation)
+        subprocess.run(
+            cmd, 
+            check=True, 
+            stdout=subprocess.PIPE, 
+            stderr=subprocess.PIPE, 
+            env=env,
+            timeout=330
+        )
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        if os.path.exists(lighthouse_report_path):
+            print("Lighthouse audit timed out, but a report was generated. Proceeding gracefully.")
+        else:
+            raise Exception("Lighthouse audit completely timed out and no report was generated.")
+    except subprocess.CalledProcessError as e:
+        if os.path.exists(lighthouse_report_path):
+            print(f"Lighthouse exited with code {e.returncode} (likely due to max-wait-for-load limit), but a report was generated. Proceeding gracefully.")
+        else:
+            error_msg = f"Lighthouse command failed with exit code {e.returncode}."
+            if e.stderr:
+                error_msg += f"\nStderr: {e.stderr.decode()}"
+            if e.stdout:
+                error_msg += f"\nStdout: {e.stdout.decode()}"
+            raise Exception(error_msg)
+        
+    # Stream the main report, keeping only what is read downstream (unless configured otherwise)
+    lighthouse_data = load_lighthouse_report(lighthouse_report_path)
+
+    # Locate and process the trace file
+    # Lighthouse --save-assets creates report_name-0.trace.json
+    trace_path = f"/tmp/report_{report_id}-0.trace.json"
+    
+    if os.path.exists(trace_path):
+        try:
+            print(f"Processing trace file: {trace_path}")
+            # Extract only Screenshot events (plus timing anchors) to keep DB size
+            # manageable; the trace is streamed since it is often tens of MB
+            with open(trace_path, 'rb') as f:
+                filtered_events = [
+                    event for event in ijson.items(f, 'traceEvents.item', use_float=True)
+                    if event.get('name') in TRACE_EVENT_NAMES
+                ]
+            
+            print(f"Extracted {len(filtered_events)} events from trace.")
+            
+            # Embed trace screenshots into the main JSON
+            lighthouse_data['trace_screenshots'] = filtered_events
+            
+            # Clean up trace file
+            os.remove(trace_path)
+            
+        except Exception as e:
+            print(f"Failed to process trace file: {e}")
+            # Don't fail the whole audit if trace processing fails
+            pass
+    else:
+        print(f"Trace file not found at: {trace_path}")
+        # List files in /tmp to debug
+        try:
+            print(f"Files in /tmp: {os.listdir('/tmp')}")
+        except:
+            pass
+    
+    # Clean up main report file
+    if os.path.exists(lighthouse_report_path):
+        os.remove(lighthouse_report_path)
+        
+    return lighthouse_data, lighthouse_report_path, timed_out
+
+# Filled in with str.format(); literal braces in the JSON example are doubled
+_PROMPT_TEMPLATE = (
+    "You are a strict technical Web Performance Analyst.\n\n"
+    "DATA FOR ANALYSIS:\n"
+    "URL: {url}\n"
+    "Core Metrics (WebVitals):\n{core_metrics_json}\n"
+    "Additional Performance Issues:\n{failed_findings_text}\n\n"
+    "THRESHOLD RULES (STRICT):\n"
+    "- LCP: Good < 2.5s, Needs Improv < 4s, Poor > 4s\n"
+    "- FCP: Good < 1.8s, Needs Improv < 3s, Poor > 3s\n"
+    "- SI (Speed Index): Good < 3.4s, Needs Improv < 5.8s, Poor > 5.8s\n"
+    "- TTI: Good < 3.8s, Needs Improv < 7.3s, Poor > 7.3s\n"
+    "- TBT: Good < 200ms, Needs Improv < 600ms, Poor > 600ms\n"
+    "- CLS: Good < 0.1, Needs Improv < 0.25, Poor > 0.25\n\n"
+    "INSTRUCTIONS:\n"
+    "1. ANALYZE the 'numeric' values of Core Metrics against the thresholds above. \n"
+    "2. TONE & PERFECTIONISM: For metrics in the 'Good' range (Low severity), your tone MUST be confirmatory and positive. \n"
+    "   - DO NOT say it 'needs improvement', is 'far from optimal', or has 'room for improvement'. \n"
+    "   - DO NOT suggest fixes unless there is a glaring, trivial optimization.\n"
+    "   - INSTEAD, state that the metric is well-optimized and explain why this value provides a great user experience.\n"
+    "3. SEVERITY: If a metric is 'Poor', it MUST be 'High' severity. If 'Needs Improvement', mark as 'Medium'. Good = 'Low'.\n"
+    "4. IMPACT: \n"
+    "   - For 'Poor'/'Medium': Describe how this value hurts the user.\n"
+    "   - For 'Good': Explain the positive benefit this value brings to the user (e.g., 'Instant visual feedback', 'Smooth interactions').\n"
+    "5. SUGGESTION: Only provide technical fixes for 'High' and 'Medium' issues. For 'Low' issues, simply suggest 'Monitor and maintain this performance' or leave blank.\n"
+    "6. REFERENCES: Always extract and include at least one high-quality documentation link from the 'description' fields provided in the data.\n\n"
+    "OUTPUT FORMAT (JSON ONLY):\n"
+    "{{\n"
+    '  "overall_assessment": "Data-driven summary based on the scores provided.",\n'
+    '  "issues": [\n'
+    '    {{\n'
+    '      "title": "Exact Metric/Issue Name",\n'
+    '      "explanation": "Technical reason for this specific number.",\n'
+    '      "impact": "User experience cost (specific to the delta from target).",\n'
+    '      "suggestion": "How to fix it.",\n'
+    '      "severity": "High" | "Medium" | "Low",\n'
+    '      "code_fix": "Optional: Specific code fix.",\n'
+    '      "references": ["Optional: URL to documentation"],\n'
+    '      "action": {{ "type": "waterfall" | "metric" | "filmstrip", "target": "Audit ID" }}\n'
+    '    }}\n'
+    '  ]\n'
+    "}}\n"
+    "Provide RAW JSON only."
+)
+
+# google-genai talks REST over an httpx connection pool owned by the client,
+# so one client per process keeps TLS connections alive between summaries
+_genai_client = None
+_genai_client_lock = threading.Lock()
+# google-genai has no HTTP timeout by default; a hung call would never return
+GEMINI_TIMEOUT = 50  # seconds, below AI_SUMMARY_WAIT so errors win over the wait
+
+
+def _get_genai_client():
+    global _genai_client
+    # Summaries run on executor threads; don't let two of them race to build clients
+    with _genai_client_lock:
+        if _genai_client is None:
+            _genai_client = genai.Client(
+                api_key=settings.GEMINI_API_KEY,
+                http_options=genai.types.HttpOptions(timeout=GEMINI_TIMEOUT * 1000),
+            )
+        return _genai_client
+
+
+def _summary_fallback(message):
+    """Fallback summary JSON so the UI still renders when Gemini is unavailable."""
+    return orjson.dumps({"overall_assessment": message, "issues": []}).decode()
+
+
+def generate_ai_summary(lighthouse_data, url):
+    """Generates an AI summary using Gemini."""
+    try:
+        gemini_api_key = settings.GEMINI_API_KEY
+        if not gemini_api_key:
+            return "Gemini API Key not configured."
+
+        # Prepare Context - Providing specific Core Metrics for data-driven analysis
+        audits = lighthouse_data.get('audits', {})
+        core_metrics_keys = [
+            'largest-contentful-paint', 
+            'total-blocking-time', 
+            'cumulative-layout-shift', 
+            'first-contentful-paint', 
+            'speed-index',
+            'interactive'
+        ]
+        
+        core_metrics = []
+        for key in core_metrics_keys:
+            audit = audits.get(key)
+            if audit:
+                core_metrics.append({
+                    'id': key,
+                    'title': audit.get('title'),
+                    'score': audit.get('score'),
+                    'value': audit.get('displayValue', audit.get('numericValue')),
+                    'numeric': audit.get('numericValue'),
+                    'description': audit.get('description', '')
+                })
+
+        # Process failed audits (excluding ones already in core_metrics to save tokens).
+        # Only the 10 worst make it into the prompt, so select them with a bounded
+        # heap and format just those.
+        failed_audits = (
+            (audit['score'], key, audit)
+            for key, audit in audits.items()
+            if key not in core_metrics_keys and audit.get('score') is not None and audit['score'] < 0.9
+        )
+        other_failed_findings = [
+            f"- {audit.get('title')} (ID: {key}, Value: {audit.get('displayValue', '')}): {audit.get('description', '')}"
+            for _, key, audit in heapq.nsmallest(10, failed_audits, key=lambda item: item[0])
+        ]
+
+        core_metrics_json = orjson.dumps(core_metrics, option=orjson.OPT_INDENT_2).decode()
+        failed_findings_text = "\n".join(other_failed_findings)
+
+        prompt = _PROMPT_TEMPLATE.format(
+            url=url,
+            core_metrics_json=core_metrics_json,
+            failed_findings_text=failed_findings_text if other_failed_findings else 'None',
+        )
+        
+        # Identical findings produce an identical prompt, so reuse the earlier answer
+        summary_cache_key = f"ai:{hashlib.sha1(prompt.encode()).hexdigest()}"
+        cached_summary = cache.get(summary_cache_key)
+        if cached_summary:
+            return cached_summary
+
+        response = _get_genai_client().models.generate_content(
+            model='gemini-2.5-flash',
+            contents=prompt,
+        )
+
+        # Robustly extract JSON object between first { and last }
+        text = response.text.strip()
+        start_idx = text.find('{')
+        end_idx = text.rfind('}')
+        if start_idx != -1 and end_idx != -1:
+            text = text[start_idx:end_idx+1]
+        else:
+            raise ValueError("No valid JSON object found in response.")
+
+        cache.set(summary_cache_key, text, timeout=settings.AI_SUMMARY_CACHE_TIMEOUT)
+        return text
+    except Exception as e:
+        print(f"AI Summary failed: {e}")
+        # Return a fallback JSON structure for UI consistency
+        return _summary_fallback(f"AI Summary unavailable due to error: {str(e)}")
+
+
+# Prefork children run one task at a time, so a small shared pool is enough
+# there. Under the gevent pool each summary gets its own greenlet instead, as a
+# fixed-size pool would queue summaries behind the worker's other audits.
+_summary_executor = ThreadPoolExecutor(max_workers=4)
+AI_SUMMARY_WAIT = 60  # seconds a task waits for Gemini once its own work is done
+
+
+def start_ai_summary(lighthouse_data, url):
+    """Starts the Gemini summary in the background and returns its future (or greenlet)."""
+    if _gevent_patched():
+        import gevent
+        return gevent.spawn(generate_ai_summary, lighthouse_data, url)
+    return _summary_executor.submit(generate_ai_summary, lighthouse_data, url)
+
+
+def wait_ai_summary(task):
+    """Result of a start_ai_summary() task, or the fallback JSON if Gemini is too slow."""
+    if _gevent_patched():
+        import gevent
+        try:
+            return task.get(timeout=AI_SUMMARY_WAIT)
+        except gevent.Timeout:
+            task.kill(block=False)
+    else:
+        try:
+            return task.result(timeout=AI_SUMMARY_WAIT)
+        except FuturesTimeoutError:
+            pass
+    print(f"AI Summary timed out after {AI_SUMMARY_WAIT}s")
+    return _summary_fallback("AI Summary unavailable: the request timed out.")
+
+MEDIA_URL_PATTERN = re.compile(r"\.(mp4|webm|ogv|ogg|mov|m4v|mp3|wav|m4a|aac|flac)(\?|#|$)", re.IGNORECASE)
+
+
+def take_screenshot(browser, url, screenshot_path, device_type='desktop'):
+    """Captures a viewport screenshot in a fresh context on the shared browser."""
+    device_config = DEVICE_CONFIGS.get(device_type, DEVICE_CONFIGS['desktop'])
+    context = browser.new_context(
+        viewport=device_config['viewport'],
+        is_mobile=device_config['is_mobile'],
+        has_touch=device_config['has_touch'],
+        device_scale_factor=device_config['device_scale_factor'],
+    )
+    try:
+        # Audio/video downloads are wasted on a still frame; only matching URLs
+        # are intercepted so the rest of the page loads without routing overhead
+        context.route(MEDIA_URL_PATTERN, lambda route: route.abort())
+        page = context.new_page()
+        # Navigate quickly just to get the visual state: DOM first, then give
+        # late resources a short, bounded chance to settle
+        page.goto(url, timeout=30000, wait_until='domcontentloaded')
+        try:
+            page.wait_for_load_state('networkidle', timeout=5000)
+        except PlaywrightTimeoutError:
+            pass
+        # Take a high-quality screenshot
+        page.screenshot(path=screenshot_path, full_page=False)
+    finally:
+        try: context.close()
+        except: pass
+    return os.path.exists(screenshot_path)
+
+
+def save_fallback_screenshot(report, lighthouse_data, screenshot_path, filename):
+    """Saves the Lighthouse final-screenshot (or last trace frame) as the report screenshot."""
+    fallback_b64 = None
+
+    # 1. Try final-screenshot audit from Lighthouse first
+    final_ss_audit = lighthouse_data.get('audits', {}).get('final-screenshot', {})
+    if final_ss_audit.get('details') and final_ss_audit['details'].get('data'):
+        fallback_b64 = final_ss_audit['details']['data']
+
+    # 2. Try last trace screenshot if final-screenshot is not available
+    if not fallback_b64:
+        trace_events = lighthouse_data.get('trace_screenshots', [])
+        screenshots = [e for e in trace_events if e.get('name') == 'Screenshot']
+        if screenshots:
+            snapshot = screenshots[-1].get('args', {}).get('snapshot')
+            if snapshot:
+                fallback_b64 = f"data:image/jpeg;base64,{snapshot}"
+
+    if not (fallback_b64 and fallback_b64.startswith('data:image/')):
+        return False
+
+    # Extract the base64 part
+    header, encoded = fallback_b64.split(',', 1)
+    with open(screenshot_path, 'wb') as f:
+        f.write(base64.b64decode(encoded))
+    with open(screenshot_path, 'rb') as f:
+        report.screenshot.save(filename, File(f), save=False)
+    report.save(update_fields=['screenshot'])
+    return True
+
+def run_browser_audit(report, screenshot_path):
+    """Runs Lighthouse and the Playwright screenshot for a report on the shared browser.
+
+    The AI summary is started as soon as Lighthouse data is available, so the
+    Gemini round-trip overlaps the progress save and the screenshot capture.
+    Returns (lighthouse_data, lighthouse_timed_out, ai_future).
+    """
+    report_id = report.id
+    url = report.url
+    device_type = report.device_type or 'desktop'
+    network_type = report.network_type or '4g'
+
+    # Fresh Chromium on the worker's persistent Playwright driver
+    with _audit_browser_lock:
+        browser, debug_port, executable_path = _browser_call(_get_browser, fresh=True)
+
+        # 2. Run Lighthouse FIRST (STEP 1: freshly launched Chromium, nothing else navigating)
+        network_preset = NETWORK_PRESETS.get(network_type, NETWORK_PRESETS['4g'])
+        print(f"Running Lighthouse on port {debug_port} (Binary: {executable_path}) for {url}...")
+        
+        lighthouse_data, _, lighthouse_timed_out = run_lighthouse(
+            url, 
+            report_id, 
+            network_preset=network_preset,
+            port=debug_port, 
+            chrome_path=executable_path,
+            device_type=device_type,
+        )
+        
+        # Update Lighthouse results early to show progress (Step 1 Complete)
+        report.lighthouse_json = lighthouse_data
+        performance_score = int(lighthouse_data.get('categories', {}).get('performance', {}).get('score', 0) * 100)
+        report.performance_score = performance_score
+
+        # The summary only needs Lighthouse data: start it before the (compressing)
+        # progress save so Gemini's round-trip overlaps the DB write and screenshot
+        ai_future = start_ai_summary(lighthouse_data, url)
+        report.save(update_fields=['lighthouse_blob', 'performance_score'])
+
+        # 3. Take High-Quality Screenshot with Playwright (STEP 2: Safe to warm up resources now)
+        # Skip this if Lighthouse already timed out (site is likely too slow/unresponsive)
+        if not lighthouse_timed_out:
+            print(f"Taking high-res screenshot for {url}...")
+            try:
+                if _browser_call(take_screenshot, browser, url, screenshot_path, device_type):
+                    # Save screenshot to DB (Step 2 Complete)
+                    with open(screenshot_path, 'rb') as f:
+                        report.screenshot.save(f"screenshot_{report_id}.png", File(f), save=False)
+                    report.save(update_fields=['screenshot'])
+                    print(f"High-quality screenshot captured and saved for {url}")
+            except Exception as ss_err:
+                print(f"Screenshot capture failed (non-critical): {ss_err}")
+                try:
+                    print(f"Attempting to use Lighthouse fallback screenshot for {url}...")
+                    if save_fallback_screenshot(report, lighthouse_data, screenshot_path, f"screenshot_{report_id}_fallback.jpg"):
+                        print(f"Fallback screenshot saved successfully for {url}")
+                    else:
+                        print(f"No fallback screenshot found in Lighthouse data for {url}.")
+                except Exception as fallback_err:
+                    print(f"Fallback screenshot processing also failed: {fallback_err}")
+
+    if lighthouse_timed_out:
+        print(f"Skipping Playwright screenshot capture because Lighthouse timed out for {url}. Attempting fallback immediately.")
+        try:
+            if save_fallback_screenshot(report, lighthouse_data, screenshot_path, f"screenshot_{report_id}_fallback_lh.jpg"):
+                print(f"Lighthouse-only fallback screenshot saved for {url}")
+        except Exception as lh_fallback_err:
+            print(f"Lighthouse-only fallback screenshot failed: {lh_fallback_err}")
+
+    return lighthouse_data, lighthouse_timed_out, ai_future
+
+
+def apply_cached_result(report, cached, screenshot_path):
+    """Copies a cached Lighthouse result onto the report and starts its AI summary."""
+    print(f"Using cached Lighthouse result for {report.url}")
+    # The entry already holds the compressed blob, so it is stored as-is and
+    # only decompressed for the AI prompt and the fallback screenshot
+    report.lighthouse_blob = cached['lighthouse_blob']
+    report.performance_score = cached['performance_score']
+    lighthouse_data = report.lighthouse_json
+    ai_future = start_ai_summary(lighthouse_data, report.url)
+    report.save(update_fields=['lighthouse_blob', 'performance_score'])
+    try:
+        save_fallback_screenshot(report, lighthouse_data, screenshot_path, f"screenshot_{report.id}_cached.jpg")
+    except Exception as cached_ss_err:
+        print(f"Cached-result screenshot failed: {cached_ss_err}")
+    return ai_future
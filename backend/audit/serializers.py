@@ -2,12 +2,22 @@ from rest_framework import serializers
 from .models import Report, SharedReport
 
 class ReportSerializer(serializers.ModelSerializer):
+    # Decompressed from Report.lighthouse_blob
+    lighthouse_json = serializers.JSONField(read_only=True)
+
     class Meta:
         model = Report
-        fields = '__all__'
-        read_only_fields = ('status', 'performance_score', 'lighthouse_json', 'ai_summary', 'screenshot', 'created_at')
+        exclude = ('lighthouse_blob',)
+        read_only_fields = ('status', 'performance_score', 'ai_summary', 'screenshot', 'created_at')
         # url, device_type, network_type, user_identifier are writable on creation
 
+class ReportListSerializer(serializers.ModelSerializer):
+    """Summary fields only, so list responses don't carry the Lighthouse report."""
+    class Meta:
+        model = Report
+        fields = ('id', 'url', 'status', 'device_type', 'network_type', 'performance_score', 'created_at', 'screenshot')
+        read_only_fields = fields
+
 class SharedReportSerializer(serializers.ModelSerializer):
     report = ReportSerializer(read_only=True)
     class Meta:
@@ -1,3 +1,354 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from sightline.celery import app as celery_app
+
+from .models import Report, compress_json, decompress_json
+from .pipeline import (
+    AUDIT_LOCK_POLL,
+    AUDIT_LOCK_WAIT,
+    DETAILED_AUDITS,
+    generate_ai_summary,
+    lighthouse_cache_key,
+    load_lighthouse_report,
+)
+from .serializers import ReportListSerializer
+from .tasks import run_audit, run_audit_cached, run_audit_full
+
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+SUMMARY_JSON = '{"overall_assessment": "ok", "issues": []}'
+
+
+def mock_genai_client(text=SUMMARY_JSON):
+    client = mock.Mock()
+    client.models.generate_content.return_value = mock.Mock(text=text)
+    return client
+
+
+SAMPLE_LIGHTHOUSE = {
+    'categories': {
+        'performance': {'id': 'performance', 'title': 'Performance', 'score': 0.87},
+        'seo': {'id': 'seo', 'title': 'SEO', 'score': 1.0},
+    },
+    'audits': {
+        'largest-contentful-paint': {'id': 'largest-contentful-paint', 'score': 0.9, 'numericValue': 2100.5},
+    },
+}
+
+
+class ReportLighthouseJsonTests(TestCase):
+    def test_round_trip(self):
+        report = Report.objects.create(url='https://example.com')
+        report.lighthouse_json = SAMPLE_LIGHTHOUSE
+        report.save()
+
+        report.refresh_from_db()
+        self.assertIsInstance(bytes(report.lighthouse_blob), bytes)
+        self.assertEqual(report.lighthouse_json, SAMPLE_LIGHTHOUSE)
+
+    def test_none_clears_blob(self):
+        report = Report(url='https://example.com')
+        report.lighthouse_json = SAMPLE_LIGHTHOUSE
+        report.lighthouse_json = None
+        self.assertIsNone(report.lighthouse_blob)
+        self.assertIsNone(report.lighthouse_json)
+
+
+class LighthouseBlobMigrationTests(TransactionTestCase):
+    before = [('audit', '0006_remove_report_display_number')]
+    after = [('audit', '0007_report_lighthouse_blob')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_forward_and_back(self):
+        apps = self.migrate(self.before)
+        OldReport = apps.get_model('audit', 'Report')
+        with_json = OldReport.objects.create(url='https://example.com', lighthouse_json=SAMPLE_LIGHTHOUSE)
+        without_json = OldReport.objects.create(url='https://example.org')
+
+        apps = self.migrate(self.after)
+        NewReport = apps.get_model('audit', 'Report')
+        self.assertEqual(decompress_json(NewReport.objects.get(id=with_json.id).lighthouse_blob), SAMPLE_LIGHTHOUSE)
+        self.assertIsNone(NewReport.objects.get(id=without_json.id).lighthouse_blob)
+
+        apps = self.migrate(self.before)
+        OldReport = apps.get_model('audit', 'Report')
+        self.assertEqual(OldReport.objects.get(id=with_json.id).lighthouse_json, SAMPLE_LIGHTHOUSE)
+        self.assertIsNone(OldReport.objects.get(id=without_json.id).lighthouse_json)
+
+
+@override_settings(AUDIT_STORE_FULL_REPORT=False)
+class LoadLighthouseReportTests(TestCase):
+    def setUp(self):
+        report = {
+            'lighthouseVersion': '12.0.0',
+            'configSettings': {'formFactor': 'desktop'},
+            'i18n': {'rendererFormattedStrings': {}},
+            'categories': {
+                'performance': {
+                    'id': 'performance', 'title': 'Performance', 'score': 0.5,
+                    'auditRefs': [{'id': 'network-requests', 'weight': 0}],
+                },
+            },
+            'audits': {
+                'network-requests': {
+                    'id': 'network-requests', 'title': 'Network Requests', 'score': None,
+                    'details': {'type': 'table', 'items': [{'url': 'https://example.com/'}]},
+                },
+                'speed-index': {
+                    'id': 'speed-index', 'title': 'Speed Index', 'score': 0.75,
+                    'displayValue': '2.1 s', 'numericValue': 2100.25,
+                    'details': {'type': 'debugdata'},
+                },
+            },
+        }
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(report, f)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_projection(self):
+        data = load_lighthouse_report(self.path)
+
+        self.assertEqual(set(data), {'categories', 'audits'})
+        self.assertEqual(data['categories']['performance'], {'id': 'performance', 'title': 'Performance', 'score': 0.5})
+
+        self.assertIn('network-requests', DETAILED_AUDITS)
+        self.assertEqual(data['audits']['network-requests']['details']['items'], [{'url': 'https://example.com/'}])
+
+        self.assertNotIn('speed-index', DETAILED_AUDITS)
+        self.assertNotIn('details', data['audits']['speed-index'])
+        self.assertEqual(data['audits']['speed-index']['numericValue'], 2100.25)
+        self.assertIsInstance(data['audits']['speed-index']['numericValue'], float)
+
+    @override_settings(AUDIT_STORE_FULL_REPORT=True)
+    def test_full_report(self):
+        data = load_lighthouse_report(self.path)
+        self.assertIn('i18n', data)
+        self.assertIn('details', data['audits']['speed-index'])
+
+
+class ReportListTests(TestCase):
+    def setUp(self):
+        report = Report.objects.create(url='https://example.com', status='completed', performance_score=87)
+        report.lighthouse_json = SAMPLE_LIGHTHOUSE
+        report.save()
+
+    def test_list_returns_summary_fields_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get('/api/reports/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+        self.assertEqual(set(response.json()[0]), set(ReportListSerializer.Meta.fields))
+        self.assertFalse(any('lighthouse_blob' in query['sql'] for query in queries))
+
+    def test_detail_includes_lighthouse_json(self):
+        report = Report.objects.get()
+        response = APIClient().get(f'/api/reports/{report.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['lighthouse_json'], SAMPLE_LIGHTHOUSE)
+        self.assertNotIn('lighthouse_blob', response.json())
+
+
+@override_settings(CACHES=LOCMEM_CACHE, GEMINI_API_KEY='test-key')
+class AiSummaryPromptTests(TestCase):
+    def test_prompt_lists_the_ten_worst_failing_audits(self):
+        audits = {
+            # Core metrics are reported separately, never as findings
+            'largest-contentful-paint': {'title': 'LCP', 'score': 0.1, 'numericValue': 6000},
+            # Passing, informative and borderline audits are not findings
+            'passing-audit': {'title': 'Passing', 'score': 1.0},
+            'borderline-audit': {'title': 'Borderline', 'score': 0.9},
+            'informative-audit': {'title': 'Informative', 'score': None},
+        }
+        for i in range(12):
+            audits[f'failing-{i}'] = {'title': f'Failing {i}', 'score': round(0.05 * (11 - i), 2)}
+        client = mock_genai_client()
+
+        with mock.patch('audit.pipeline._get_genai_client', return_value=client):
+            summary = generate_ai_summary({'audits': audits}, 'https://example.com')
+
+        self.assertEqual(summary, SUMMARY_JSON)
+        prompt = client.models.generate_content.call_args.kwargs['contents']
+        finding_ids = [line.split('(ID: ')[1].split(',')[0] for line in prompt.splitlines() if '(ID: ' in line]
+        # Worst first, not the first ten in report order (failing-0 scores 0.55, failing-11 scores 0)
+        self.assertEqual(finding_ids, [f'failing-{i}' for i in range(11, 1, -1)])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, GEMINI_API_KEY='test-key')
+class AuditTaskTests(TestCase):
+    """Dispatch, result cache and lock flow, with the browser, Lighthouse and Gemini mocked."""
+
+    def setUp(self):
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        cache.clear()
+
+        self.report = Report.objects.create(url='https://example.com')
+        self.cache_key = lighthouse_cache_key(self.report.url, 'desktop', '4g')
+        self.run_lighthouse = self.patch('audit.pipeline.run_lighthouse', return_value=(SAMPLE_LIGHTHOUSE, None, False))
+        self.patch('audit.pipeline._get_browser', return_value=(mock.Mock(), 9222, '/usr/bin/chromium'))
+        self.patch('audit.pipeline.take_screenshot', return_value=False)
+        self.patch('audit.pipeline._get_genai_client', return_value=mock_genai_client())
+        self.patch('audit.tasks.get_page_validators', return_value='')
+
+    def patch(self, target, **kwargs):
+        patcher = mock.patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def assertCompleted(self):
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.status, 'completed')
+        self.assertEqual(self.report.performance_score, 87)
+        self.assertEqual(self.report.lighthouse_json, SAMPLE_LIGHTHOUSE)
+        self.assertEqual(self.report.ai_summary, SUMMARY_JSON)
+
+    def test_cache_miss_runs_full_audit_and_caches_result(self):
+        run_audit.delay(self.report.id)
+
+        self.run_lighthouse.assert_called_once()
+        self.assertCompleted()
+        cached = cache.get(self.cache_key)
+        self.assertEqual(decompress_json(cached['lighthouse_blob']), SAMPLE_LIGHTHOUSE)
+        self.assertEqual(cached['performance_score'], 87)
+
+    def test_cache_hit_goes_to_run_audit_cached(self):
+        cache.set(self.cache_key, {'lighthouse_blob': compress_json(SAMPLE_LIGHTHOUSE), 'performance_score': 87})
+
+        with mock.patch.object(run_audit_cached, 'delay', wraps=run_audit_cached.delay) as cached_delay:
+            run_audit.delay(self.report.id)
+
+        cached_delay.assert_called_once_with(self.report.id, self.cache_key)
+        self.run_lighthouse.assert_not_called()
+        self.assertCompleted()
+
+    def test_timed_out_run_is_not_cached(self):
+        self.run_lighthouse.return_value = (SAMPLE_LIGHTHOUSE, None, True)
+
+        run_audit.delay(self.report.id)
+
+        self.assertCompleted()
+        self.assertIsNone(cache.get(self.cache_key))
+
+    def test_held_lock_waits_on_fast_queue(self):
+        self.patch('audit.tasks.acquire_audit_lock', return_value=(None, True))
+
+        with mock.patch.object(run_audit_cached, 'apply_async') as cached_async:
+            run_audit_full(self.report.id, self.cache_key)
+
+        cached_async.assert_called_once_with(
+            (self.report.id, self.cache_key, AUDIT_LOCK_POLL), countdown=AUDIT_LOCK_POLL,
+        )
+        self.run_lighthouse.assert_not_called()
+
+    def test_waiting_duplicate_backs_off_while_lock_held(self):
+        self.patch('audit.tasks.audit_lock_held', return_value=True)
+
+        with mock.patch.object(run_audit_cached, 'apply_async') as cached_async, \
+                mock.patch.object(run_audit_full, 'delay') as full_delay:
+            run_audit_cached(self.report.id, self.cache_key, 20)
+
+        cached_async.assert_called_once_with((self.report.id, self.cache_key, 40), countdown=20)
+        full_delay.assert_not_called()
+
+    def test_waiting_duplicate_runs_full_audit_once_lock_is_free(self):
+        self.patch('audit.tasks.audit_lock_held', return_value=False)
+
+        with mock.patch.object(run_audit_full, 'delay') as full_delay:
+            run_audit_cached(self.report.id, self.cache_key, 20)
+
+        full_delay.assert_called_once_with(self.report.id, self.cache_key, 20)
+
+    def test_wait_budget_spent_runs_own_audit(self):
+        acquire = self.patch('audit.tasks.acquire_audit_lock', return_value=(None, True))
+
+        run_audit_full(self.report.id, self.cache_key, AUDIT_LOCK_WAIT)
+
+        acquire.assert_not_called()
+        self.run_lighthouse.assert_called_once()
+        self.assertCompleted()
+
+    def test_failure_marks_report_failed(self):
+        broken = {'categories': {'performance': {'score': None}}, 'audits': {}}
+        self.run_lighthouse.return_value = (broken, None, False)
+
+        run_audit.delay(self.report.id)
+
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.status, 'failed')
+        self.assertTrue(self.report.ai_summary.startswith('Error: '))
+
+    def test_dispatch_failure_marks_report_failed(self):
+        self.patch('audit.tasks.lighthouse_cache_key', side_effect=RuntimeError('cache down'))
+
+        run_audit.delay(self.report.id)
+
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.status, 'failed')
+        self.assertEqual(self.report.ai_summary, 'Error: cache down')
+
+
+@override_settings(CACHES=LOCMEM_CACHE, GEMINI_API_KEY='test-key')
+class AiSummaryTimeoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.report = Report.objects.create(url='https://example.com')
+        self.cache_key = lighthouse_cache_key(self.report.url, 'desktop', '4g')
+        cache.set(self.cache_key, {'lighthouse_blob': compress_json(SAMPLE_LIGHTHOUSE), 'performance_score': 87})
+
+    def assertTimeoutFallbackStored(self):
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.status, 'completed')
+        self.assertEqual(json.loads(self.report.ai_summary), {
+            'overall_assessment': 'AI Summary unavailable: the request timed out.',
+            'issues': [],
+        })
+
+    def test_slow_summary_stores_fallback(self):
+        def slow_summary(lighthouse_data, url):
+            time.sleep(1)
+            return SUMMARY_JSON
+
+        with mock.patch('audit.pipeline.AI_SUMMARY_WAIT', 0.1), \
+                mock.patch('audit.pipeline.generate_ai_summary', side_effect=slow_summary):
+            run_audit_cached(self.report.id, self.cache_key)
+
+        self.assertTimeoutFallbackStored()
+
+    def test_slow_summary_stores_fallback_under_gevent(self):
+        import gevent
+
+        def slow_summary(lighthouse_data, url):
+            gevent.sleep(1)
+            return SUMMARY_JSON
+
+        with mock.patch('audit.pipeline._gevent_patched', return_value=True), \
+                mock.patch('audit.pipeline.AI_SUMMARY_WAIT', 0.1), \
+                mock.patch('audit.pipeline.generate_ai_summary', side_effect=slow_summary):
+            run_audit_cached(self.report.id, self.cache_key)
+
+        self.assertTimeoutFallbackStored()
@@ -9,12 +9,24 @@ from django.conf import settings
 from django.http import JsonResponse
 from django.views import View
 from .models import Report, SharedReport
-from .serializers import ReportSerializer, SharedReportSerializer
+from .serializers import ReportSerializer, ReportListSerializer, SharedReportSerializer
 from .tasks import run_audit, cleanup_old_reports, cleanup_expired_shares
 
 class ReportViewSet(viewsets.ModelViewSet):
     queryset = Report.objects.all().order_by('-created_at')
     serializer_class = ReportSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # Never load the Lighthouse blob for list pages
+            queryset = queryset.only(*ReportListSerializer.Meta.fields)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ReportListSerializer
+        return ReportSerializer
     
     def get_throttles(self):
         if self.action == 'create':
@@ -72,7 +84,11 @@ class ReportViewSet(viewsets.ModelViewSet):
             return Response({'error': 'user_identifier parameter is required'}, status=400)
 
         # Filter reports by user_identifier, order by newest first, limit to last 20
-        reports = Report.objects.filter(user_identifier=user_identifier).order_by('-created_at')[:20]
+        reports = (
+            Report.objects.filter(user_identifier=user_identifier)
+            .only('id', 'url', 'device_type', 'network_type', 'performance_score', 'created_at')
+            .order_by('-created_at')[:20]
+        )
         
         # Serialize only the fields needed for the history table
         data = [
@@ -143,6 +143,12 @@ if USE_S3:
     AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME')
     AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')
     AWS_S3_REGION_NAME = os.environ.get('AWS_S3_REGION_NAME', 'us-east-1')
+    # Optional CDN in front of the bucket (e.g. CloudFront). With a key pair set
+    # screenshot URLs are CloudFront-signed, otherwise S3 pre-signed URLs are used
+    AWS_S3_CUSTOM_DOMAIN = os.environ.get('AWS_S3_CUSTOM_DOMAIN') or None
+    AWS_CLOUDFRONT_KEY_ID = os.environ.get('AWS_CLOUDFRONT_KEY_ID') or None
+    AWS_CLOUDFRONT_KEY = os.environ.get('AWS_CLOUDFRONT_KEY', '').replace('\\n', '\n').encode() or None
+    AWS_QUERYSTRING_EXPIRE = int(os.environ.get('AWS_QUERYSTRING_EXPIRE', 3600))
     
     # Modern Django 4.2+ Storages configuration
     STORAGES = {
@@ -156,6 +162,12 @@ if USE_S3:
                 "region_name": AWS_S3_REGION_NAME,
                 "file_overwrite": False,
                 "querystring_auth": True,
+                "querystring_expire": AWS_QUERYSTRING_EXPIRE,
+                "custom_domain": AWS_S3_CUSTOM_DOMAIN,
+                "cloudfront_key_id": AWS_CLOUDFRONT_KEY_ID,
+                "cloudfront_key": AWS_CLOUDFRONT_KEY,
+                # Screenshot names are never reused, so CDNs and browsers may cache them
+                "object_parameters": {"CacheControl": "max-age=86400"},
             },
         },
         "staticfiles": {
@@ -188,6 +200,21 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Cached-result audits (AI summary + save) must not queue behind full
+# Lighthouse runs, so they are served by separate workers
+CELERY_TASK_ROUTES = {
+    'audit.tasks.run_audit': {'queue': 'fast'},
+    'audit.tasks.run_audit_cached': {'queue': 'fast'},
+    'audit.tasks.run_audit_full': {'queue': 'heavy'},
+}
+# Unrouted tasks (cleanups, debug_task) go to a queue a worker actually consumes
+CELERY_TASK_DEFAULT_QUEUE = 'fast'
+# Audits are long; don't let one busy worker hoard queued tasks
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Prefork children warm up Chromium and the Lighthouse CLI before reporting
+# ready (audit.pipeline.warm_up_worker); the 4s default would kill them mid-launch
+CELERY_WORKER_PROC_ALIVE_TIMEOUT = 120
+
 import ssl
 
 # Remote Redis (Upstash/Managed) needs SSL support for 'rediss://'
@@ -195,6 +222,30 @@ if CELERY_BROKER_URL and CELERY_BROKER_URL.startswith('rediss://'):
     CELERY_BROKER_USE_SSL = {'ssl_cert_reqs': ssl.CERT_NONE}
     CELERY_REDIS_BACKEND_USE_SSL = {'ssl_cert_reqs': ssl.CERT_NONE}
 
+# Cache (Lighthouse results and AI summaries), shares the Celery Redis by default
+REDIS_CACHE_URL = os.environ.get('REDIS_CACHE_URL', CELERY_BROKER_URL)
+
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+                # A Redis outage should degrade to cache misses, not failed audits
+                'IGNORE_EXCEPTIONS': True,
+            },
+        }
+    }
+    if REDIS_CACHE_URL.startswith('rediss://'):
+        CACHES['default']['OPTIONS']['CONNECTION_POOL_KWARGS'] = {'ssl_cert_reqs': None}
+
+# How long (seconds) a Lighthouse result is reused for the same URL/device/network
+AUDIT_CACHE_TIMEOUT = int(os.environ.get('AUDIT_CACHE_TIMEOUT', 3600))
+# How long (seconds) a Gemini summary is reused for identical findings
+AI_SUMMARY_CACHE_TIMEOUT = int(os.environ.get('AI_SUMMARY_CACHE_TIMEOUT', 86400))
+# Store the complete Lighthouse report instead of the projection the UI reads
+AUDIT_STORE_FULL_REPORT = os.environ.get('AUDIT_STORE_FULL_REPORT', '0') == '1'
 
 
 # REST Framework Configuration
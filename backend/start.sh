@@ -7,8 +7,12 @@ python manage.py migrate --noinput
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
 
-echo "Starting Celery Worker in background..."
-celery -A sightline worker --loglevel=info --concurrency=1 &
+echo "Starting Celery Workers in background..."
+# fast: cache hits + dispatch (I/O-bound), heavy: Chrome + Lighthouse runs
+# heavy runs one audit per host: parallel throttled Lighthouse runs compete for
+# CPU and skew TBT/TTI, so scale it out with more hosts instead
+celery -A sightline worker -n fast@%h -Q fast --loglevel=info --pool=gevent --concurrency=100 &
+celery -A sightline worker -n heavy@%h -Q heavy --loglevel=info --pool=prefork --concurrency=1 &
 
 echo "Starting Gunicorn..."
 exec gunicorn sightline.wsgi:application \